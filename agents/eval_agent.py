@@ -1,41 +1,151 @@
-import queue
+import ast
+import functools
+import types
+import warnings
 import numpy as np
-import pandas as pd
-from backtester.portfolio import Portfolio
-from backtester.execution import SimulatedExecutionHandler
-from backtester.events import SignalEvent, MarketEvent
 
-# Helper functions for factor evaluation
+# Helper functions for factor evaluation. NumPy panels use the kernels below; DataFrames keep the pandas path.
 def Rank(df):
+    if isinstance(df, np.ndarray):
+        return _rank_panel(df)
     return df.rank(axis=1, pct=True)
 
 def ts_delta(df, period=1):
+    if isinstance(df, np.ndarray):
+        return _ts_delta_panel(df, period)
     return df.diff(period)
 
+# NumPy kernels used by compiled factors. Every series is a (T, N) panel with one column per symbol.
+def _as_float(x) -> np.ndarray:
+    """
+    Returns x as a floating-point array, keeping single-precision panels in single precision.
+    """
+    x = np.asarray(x)
+    return x if x.dtype.kind == 'f' else x.astype(np.float64)
+
+def _rank_panel(x: np.ndarray) -> np.ndarray:
+    """
+    Cross-sectional percentile rank of each row, ignoring NaNs.
+    """
+    x = _as_float(x)
+    valid = ~np.isnan(x)
+    # A single row-wise argsort; NaNs sort last, so the valid entries of each row occupy positions 0..count-1
+    order = np.argsort(x, axis=1)
+    ranked = np.take_along_axis(x, order, axis=1)
+    # Tied values share the average rank of their run of sorted positions, like pandas' method='average'
+    position = np.arange(x.shape[1])
+    starts = np.ones(x.shape, dtype=bool)
+    starts[:, 1:] = ranked[:, 1:] != ranked[:, :-1]
+    ends = np.ones(x.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+    first = np.maximum.accumulate(np.where(starts, position, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, position, x.shape[1])[:, ::-1], axis=1)[:, ::-1]
+    ranks = np.empty_like(x)
+    np.put_along_axis(ranks, order, ((first + last) / 2 + 1).astype(x.dtype), axis=1)
+    counts = valid.sum(axis=1, keepdims=True).astype(x.dtype)
+    return np.divide(ranks, counts, out=np.full_like(ranks, np.nan), where=valid)
+
+def _ts_delta_panel(x: np.ndarray, period: int = 1) -> np.ndarray:
+    """
+    Difference between each value and the value `period` bars earlier, NaN-padded at the start.
+    """
+    period = int(period)
+    if period < 1:
+        raise ValueError(f"ts_delta period must be positive, got {period}")
+    x = _as_float(x)
+    out = np.full_like(x, np.nan)
+    out[period:] = x[period:] - x[:-period]
+    return out
+
+def _correlation_panel(x: np.ndarray, y: np.ndarray, window: int) -> np.ndarray:
+    """
+    Rolling Pearson correlation of two panels over `window` bars, computed per symbol.
+    """
+    window = int(window)
+    x = _as_float(x)
+    y = _as_float(y)
+    out = np.full(np.broadcast_shapes(x.shape, y.shape), np.nan, dtype=np.result_type(x, y))
+    if window < 2 or window > out.shape[0]:
+        return out
+    x, y = np.broadcast_to(x, out.shape), np.broadcast_to(y, out.shape)
+    xw = np.lib.stride_tricks.sliding_window_view(x, window, axis=0)
+    yw = np.lib.stride_tricks.sliding_window_view(y, window, axis=0)
+    xd = xw - xw.mean(axis=-1, keepdims=True)
+    yd = yw - yw.mean(axis=-1, keepdims=True)
+    cov = (xd * yd).sum(axis=-1)
+    denom = np.sqrt((xd * xd).sum(axis=-1) * (yd * yd).sum(axis=-1))
+    np.divide(cov, denom, out=out[window - 1:], where=denom > 0)
+    return out
+
+_FACTOR_FUNCTIONS = {
+    'Rank': _rank_panel,
+    'ts_delta': _ts_delta_panel,
+    'Correlation': _correlation_panel,
+}
+_FACTOR_SERIES = frozenset({'open', 'high', 'low', 'close', 'volume'})
+_FACTOR_NODES = (
+    ast.Expression, ast.Call, ast.keyword, ast.Name, ast.Load, ast.Constant,
+    ast.BinOp, ast.UnaryOp, ast.operator, ast.unaryop,
+)
+
+@functools.lru_cache(maxsize=256)
+def _compile_factor(factor_code: str) -> tuple[types.FunctionType, tuple[str, ...]]:
+    """
+    Parses and validates a formula once and compiles it into a function of the data series it reads.
+    Only the helper functions above, the bar series and arithmetic are allowed.
+
+    Returns:
+        The compiled function and the names of its positional arguments, e.g. ('close', 'volume').
+    """
+    tree = ast.parse(factor_code.strip(), mode='eval')
+    series = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, _FACTOR_NODES):
+            raise ValueError(f"Unsupported syntax in factor: {type(node).__name__}")
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in _FACTOR_FUNCTIONS):
+            raise ValueError(f"Unsupported function call in factor: {ast.unparse(node.func)}")
+        if isinstance(node, ast.Name) and node.id not in _FACTOR_FUNCTIONS:
+            if node.id not in _FACTOR_SERIES:
+                raise ValueError(f"Unknown name in factor: {node.id}")
+            series.add(node.id)
+
+    # Wrap the expression as `lambda <series>: <formula>`, so each evaluation is a plain function call
+    params = tuple(sorted(series))
+    arguments = ast.arguments(
+        posonlyargs=[], args=[ast.arg(arg=name) for name in params], kwonlyargs=[], kw_defaults=[], defaults=[],
+    )
+    wrapper = ast.fix_missing_locations(ast.Expression(body=ast.Lambda(args=arguments, body=tree.body)))
+    code = compile(wrapper, '<factor>', 'eval')
+    return eval(code, {'__builtins__': {}, **_FACTOR_FUNCTIONS}), params
+
 class EvalAgent:
     """
-    The EvalAgent class is responsible for evaluating a factor by running a backtest and generating feedback.
+    The EvalAgent class is responsible for evaluating a factor against forward returns and generating feedback.
     """
 
-    def _apply_factor(self, factor_code: str, data: pd.DataFrame) -> pd.DataFrame | None:
+    def _apply_factor(self, factor_code: str, get_panel) -> np.ndarray | None:
         """
-        Applies the factor to the historical data.
-        This is a simplified and unsafe implementation using eval.
-        In a real-world scenario, a safer parsing and execution mechanism should be used.
+        Applies the factor to the historical data of all symbols at once.
+        The formula is compiled once per distinct string into a function that is called on (T, N) NumPy panels.
+
+        Args:
+            factor_code: A string representing the formulaic alpha.
+            get_panel: A callable returning the (T, N) panel for a bar field, e.g. data_handler.get_panel.
+
+        Returns:
+            The (T, N) factor panel, or None if the formula could not be evaluated.
         """
         try:
-            # For simplicity, we assume the data has a 'Close' column
-            close = data['Close']
-            # The factor code is evaluated in the context of the helper functions
-            factor_values = eval(factor_code, globals(), {'close': close})
-            return factor_values
+            factor_fn, series = _compile_factor(factor_code)
+            factor_values = factor_fn(*[get_panel(name) for name in series])
+            return np.broadcast_to(_as_float(factor_values), get_panel('close').shape)
         except Exception as e:
             print(f"Error applying factor: {e}")
             return None
 
     def evaluate_factor(self, factor_code: str, data_handler) -> dict:
         """
-        Evaluates a factor by running a backtest and generating feedback.
+        Evaluates a factor by scoring it against forward returns and generating feedback.
 
         Args:
             factor_code: A string representing the formulaic alpha.
@@ -44,55 +154,34 @@ class EvalAgent:
         Returns:
             A dictionary containing performance metrics and LLM-generated feedback.
         """
-        events: queue.Queue = queue.Queue()
-        bars = data_handler
-        start_date = data_handler.symbol_data[data_handler.symbol_list[0]].index[0]
-        portfolio = Portfolio(bars, events, start_date, initial_capital=100000.0)
-        broker = SimulatedExecutionHandler(events)
-
-        # Get all data for factor calculation
-        all_data = {}
-        for symbol in data_handler.symbol_list:
-            all_data[symbol] = pd.DataFrame(data_handler.symbol_data[symbol], columns=data_handler.symbol_data[symbol].columns)
-        
-        # This is a simplification. In a real backtest, you would get data bar by bar.
-        # For factor evaluation, we often need the full history at once.
-        # We will assume a single dataframe with all symbols for this example.
-        # This part of the code needs to be adapted to the actual data format.
-        # For now, we will skip the data transformation and assume a single dataframe.
-        
-        # --- This is a placeholder for the backtesting loop ---
-        # In a real implementation, you would have a loop that processes events
-        # and updates the portfolio.
-        # For this example, we will generate some dummy results.
-
-        # 1. Apply the factor (dummy implementation)
-        # factor_values = self._apply_factor(factor_code, all_data_df)
-
-        # 2. Generate signals (dummy implementation)
-        # signals = self._generate_signals(factor_values)
-
-        # 3. Run backtest (dummy implementation)
-        # The backtest loop would process MarketEvents, generate SignalEvents,
-        # which are then converted to OrderEvents and FillEvents.
-        # This is a complex process that is already partially implemented in the backtester module.
-        # For this example, we will just create some dummy stats.
-
-        # Create dummy equity curve
-        dummy_returns = np.random.rand(100) * 0.01 - 0.005
-        dummy_equity_curve = (1 + dummy_returns).cumprod()
-        
-        # Create a dummy portfolio to generate stats
-        class DummyPortfolio:
-            def __init__(self):
-                self.equity_curve = pd.DataFrame({'equity_curve': dummy_equity_curve, 'returns': dummy_returns})
-            def output_summary_stats(self):
-                return [("Total Return", "10.50%"), ("Sharpe Ratio", "1.5"), ("Max Drawdown", "5.20%"), ("Drawdown Duration", "10")]
-
-        dummy_portfolio = DummyPortfolio()
-        performance_metrics = dummy_portfolio.output_summary_stats()
-
-        # 4. Generate feedback
+        # The handler's cached panels are used directly, without copying any per-symbol history
+        return self.evaluate_panels(factor_code, data_handler.get_panel, data_handler.get_returns_panel())
+
+    def evaluate_panels(self, factor_code: str, get_panel, returns_panel: np.ndarray) -> dict:
+        """
+        Evaluates a factor on precomputed panels, e.g. in a worker process without an IBKR connection.
+
+        Args:
+            factor_code: A string representing the formulaic alpha.
+            get_panel: A callable returning the (T, N) panel for a bar field.
+            returns_panel: The (T-1, N) panel of one-bar log returns.
+
+        Returns:
+            A dictionary containing performance metrics and LLM-generated feedback.
+        """
+        # 1. Apply the factor to the (T, N) panels of all symbols
+        factor_values = self._apply_factor(factor_code, get_panel)
+        if factor_values is None:
+            return {
+                "performance_metrics": [],
+                "feedback": "The factor could not be evaluated. Use only Rank, ts_delta and Correlation on the close, open, high, low and volume series."
+            }
+
+        # 2. Compute the metrics directly from the factor and forward returns.
+        # No portfolio is simulated, so there is no event loop or per-bar state to carry around.
+        performance_metrics = self._fast_metrics(factor_values, returns_panel)
+
+        # 3. Generate feedback
         feedback = self._generate_feedback(performance_metrics)
 
         return {
@@ -100,6 +189,66 @@ class EvalAgent:
             "feedback": feedback
         }
 
+    def _fast_metrics(self, factor_panel: np.ndarray, returns_panel: np.ndarray, periods: int = 252) -> list:
+        """
+        Creates a list of summary statistics for a factor using vectorized reductions only.
+        The factor at bar t is scored against the return from t to t+1 with a long-short position on
+        each side of the cross-sectional median, so every bar is evaluated independently.
+        With a single symbol there is no cross-section, so the position is the sign of the factor
+        and the IC is the correlation of the factor and the forward returns over time.
+
+        Args:
+            factor_panel: The (T, N) factor panel.
+            returns_panel: The (T-1, N) panel of one-bar log returns.
+            periods: Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+        """
+        valid = ~(np.isnan(factor_panel[:-1]) | np.isnan(returns_panel))
+        f = np.where(valid, factor_panel[:-1], np.nan)
+        r = np.where(valid, returns_panel, np.nan)
+
+        with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+            # Bars without observations (e.g. the ts_delta warm-up) reduce to NaN and are dropped below
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            # Demean across symbols (one IC per bar), or over time when there is only one symbol
+            axis = 1 if f.shape[1] > 1 else 0
+            fd = f - np.nanmean(f, axis=axis, keepdims=True)
+            rd = r - np.nanmean(r, axis=axis, keepdims=True)
+            ic = np.nansum(fd * rd, axis=axis) / np.sqrt(np.nansum(fd * fd, axis=axis) * np.nansum(rd * rd, axis=axis))
+            if axis == 1:
+                positions = np.sign(f - np.nanmedian(f, axis=1, keepdims=True))
+            else:
+                positions = np.sign(f)
+            ls_returns = np.nanmean(positions * r, axis=1)
+            turnover = np.nanmean(np.abs(np.diff(positions, axis=0)))
+
+        ic = ic[np.isfinite(ic)]
+        ls_returns = ls_returns[np.isfinite(ls_returns)]
+        mean_ic = ic.mean() if ic.size else 0.0
+        turnover = turnover if np.isfinite(turnover) else 0.0
+
+        if ls_returns.size:
+            std = ls_returns.std()
+            sharpe_ratio = np.sqrt(periods) * ls_returns.mean() / std if std > 0 else 0.0
+            equity_curve = np.exp(np.cumsum(ls_returns))
+            hwm = np.maximum.accumulate(np.maximum(equity_curve, 1.0))
+            drawdown = 1.0 - equity_curve / hwm
+            # Bars elapsed since the most recent high water mark
+            idx = np.arange(1, drawdown.size + 1)
+            last_peak = np.maximum.accumulate(np.where(drawdown == 0, idx, 0))
+            total_return = equity_curve[-1]
+            max_dd, dd_duration = drawdown.max(), int((idx - last_peak).max())
+        else:
+            sharpe_ratio, total_return, max_dd, dd_duration = 0.0, 1.0, 0.0, 0
+
+        return [
+            ("Total Return", f"{(total_return - 1.0) * 100.0:.2f}%"),
+            ("Sharpe Ratio", f"{sharpe_ratio:.2f}"),
+            ("Max Drawdown", f"{max_dd * 100.0:.2f}%"),
+            ("Drawdown Duration", f"{dd_duration}"),
+            ("IC", f"{mean_ic:.4f}"),
+            ("Turnover", f"{turnover:.4f}"),
+        ]
+
     def _generate_feedback(self, performance_metrics: list) -> str:
         """
         Generates feedback based on the backtest results.
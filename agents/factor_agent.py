@@ -1,9 +1,97 @@
 import ast
-import difflib
-import json
+import functools
+import re
 from typing import Optional
 
-from utils.llm_client import LLMClient
+import orjson
+
+from utils.llm_client import AsyncLLMClient, LLMClient
+from utils.memo import BoundedMemo
+
+# Keywords of the heuristic fallback, all matched in a single pass over the hypothesis text
+_KEYWORD_RE = re.compile(
+    r'(?P<breakout>breakout)|(?P<momentum>momentum)|(?P<order_flow>order\s+flow)'
+    r'|(?P<imbalance>imbalance)|(?P<mean_reversion>mean\s+reversion|revert)',
+    re.IGNORECASE,
+)
+# Checked in order; the first rule whose keywords all appear selects the formula
+_HEURISTIC_FORMULAS = [
+    (frozenset({'breakout', 'momentum'}), "Rank(ts_delta(close, 20) - ts_delta(close, 5))"),
+    (frozenset({'order_flow', 'imbalance'}), "Rank(ts_delta(close, 1) * volume)"),
+    (frozenset({'mean_reversion'}), "-ts_delta(close, 5) / close"),
+]
+_DEFAULT_FORMULA = "Rank(ts_delta(close, 7) - ts_delta(close, 30))"
+
+@functools.lru_cache(maxsize=1024)
+def _parse_formula(formula: str) -> ast.Module:
+    """
+    Parses a formula once; callers must treat the returned tree as read-only.
+    """
+    return ast.parse(formula)
+
+def _is_number(node: ast.AST) -> bool:
+    """
+    Whether a node is a numeric literal, including negative ones such as -1.
+    """
+    if isinstance(node, ast.UnaryOp):
+        return _is_number(node.operand)
+    return isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool)
+
+def _shape_tokens(tree: ast.AST, trailing_numbers: bool = True) -> list[str]:
+    """
+    Serializes an AST in pre-order into function/series names and node types.
+    Numeric constants become a placeholder, so formulas differing only in window lengths share their tokens.
+    Without trailing_numbers, the trailing numeric arguments of calls are dropped, so RSI(close, 14) matches RSI(close).
+    """
+    tokens = ['^']
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.Name):
+            tokens.append(node.id)
+        elif isinstance(node, ast.Constant):
+            tokens.append('<num>' if isinstance(node.value, (int, float)) else repr(node.value))
+        elif not isinstance(node, (ast.Module, ast.Expr, ast.expr_context)):
+            tokens.append(type(node).__name__)
+        if isinstance(node, ast.Call) and not trailing_numbers:
+            args = list(node.args)
+            while args and _is_number(args[-1]):
+                args.pop()
+            children = [node.func, *args, *node.keywords]
+        else:
+            children = list(ast.iter_child_nodes(node))
+        stack.extend(reversed(children))
+    tokens.append('$')
+    return tokens
+
+def _core_shapes(tree: ast.AST):
+    """
+    Yields the shape of a formula, then of what remains after each outer sign flip, Rank,
+    or arithmetic with a numeric constant is peeled off, e.g. 2 * -Rank(close) -> Rank(close) -> close.
+    """
+    body = getattr(tree, 'body', None)
+    if not (isinstance(body, list) and len(body) == 1 and isinstance(body[0], ast.Expr)):
+        return
+    node = body[0].value
+    while node is not None:
+        yield tuple(_shape_tokens(node, trailing_numbers=False))
+        if isinstance(node, ast.UnaryOp):
+            node = node.operand
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'Rank'
+                and len(node.args) == 1 and not node.keywords):
+            node = node.args[0]
+        elif isinstance(node, ast.BinOp) and _is_number(node.right):
+            node = node.left
+        elif isinstance(node, ast.BinOp) and _is_number(node.left):
+            node = node.right
+        else:
+            node = None
+
+def _ngrams(tokens: list[str], n: int = 3) -> frozenset:
+    """
+    Returns the set of token n-grams of a sequence.
+    """
+    return frozenset(tuple(tokens[i:i + n]) for i in range(max(len(tokens) - n + 1, 1)))
 
 class FactorAgent:
     """
@@ -19,47 +107,50 @@ class FactorAgent:
             'ts_delta(close, 10)',
             'Correlation(close, volume, 20)'
         ]
+        self._common_ngrams = [_ngrams(_shape_tokens(_parse_formula(f))) for f in self.common_factors]
+        self._common_shapes = {
+            tuple(_shape_tokens(_parse_formula(f), trailing_numbers=False)): f for f in self.common_factors
+        }
+        # Successful LLM formulas of both the single and the batched path, keyed on
+        # (canonical hypothesis JSON, temperature), so equal hypotheses skip the LLM round-trip
+        self._memo = BoundedMemo(maxsize=1024)
 
-    def _get_ast_depth(self, node):
+    def _check_complexity(self, tree: ast.AST) -> bool:
         """
-        Recursively calculates the depth of an AST node.
+        Checks the complexity of the parsed formula.
+        A formula is considered too complex if its depth is greater than 7 or it has more than 5 parameters.
+        Depth and parameters are counted in a single iterative pass that stops as soon as a limit is exceeded.
         """
-        if not isinstance(node, ast.AST):
-            return 0
-        
         max_depth = 0
-        for child_node in ast.iter_child_nodes(node):
-            max_depth = max(max_depth, self._get_ast_depth(child_node))
-            
-        return max_depth + 1
+        num_params = 0
+        stack = [(tree, 1)]
+        while stack:
+            node, depth = stack.pop()
+            max_depth = max(max_depth, depth)
+            if isinstance(node, ast.Call):
+                num_params += len(node.args)
+            if max_depth > 7 or num_params > 5:
+                print(f"Complexity check failed: depth={max_depth}, params={num_params}")
+                return False
+            stack.extend((child, depth + 1) for child in ast.iter_child_nodes(node))
+        return True
 
-    def _check_complexity(self, formula: str) -> bool:
+    def _check_originality(self, tree: ast.AST) -> bool:
         """
-        Checks the complexity of the formula.
-        A formula is considered too complex if its depth is greater than 7 or it has more than 5 parameters.
+        Checks the originality of the parsed formula by comparing its AST to a list of common factors.
+        Similarity is the Jaccard index of the token n-grams of both ASTs. A common factor that is only
+        negated, ranked, shifted or scaled by constants, or given extra window arguments, is rejected as well,
+        since short formulas share too few n-grams for Jaccard to catch it.
         """
-        try:
-            tree = ast.parse(formula)
-            depth = self._get_ast_depth(tree)
-            
-            num_params = 0
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Call):
-                    num_params += len(node.args)
-
-            if depth > 7 or num_params > 5:
-                print(f"Complexity check failed: depth={depth}, params={num_params}")
+        for shape in _core_shapes(tree):
+            common_factor = self._common_shapes.get(shape)
+            if common_factor is not None:
+                print(f"Originality check failed: wraps {common_factor}")
                 return False
-            return True
-        except SyntaxError:
-            return False
 
-    def _check_originality(self, formula: str) -> bool:
-        """
-        Checks the originality of the formula by comparing its AST to a list of common factors.
-        """
-        for common_factor in self.common_factors:
-            similarity = difflib.SequenceMatcher(None, formula, common_factor).ratio()
+        ngrams = _ngrams(_shape_tokens(tree))
+        for common_factor, common_ngrams in zip(self.common_factors, self._common_ngrams):
+            similarity = len(ngrams & common_ngrams) / len(ngrams | common_ngrams)
             if similarity > 0.8:
                 print(f"Originality check failed: similar to {common_factor} with similarity {similarity:.2f}")
                 return False
@@ -75,48 +166,100 @@ class FactorAgent:
         Returns:
             A string representing the formulaic alpha, or an error message if regularization checks fail.
         """
-        # This is a simplified implementation. In a real-world scenario, this method would use an LLM to generate the formula.
-        # For this example, we will use a predefined formula based on the hypothesis.
-
         formula: Optional[str] = None
-
         if self.llm and self.llm.is_available():
-            try:
-                formula = self._generate_with_llm(hypothesis)
-            except Exception as exc:
-                print(f"LLM factor generation failed, falling back to heuristics: {exc}")
+            key = (orjson.dumps(hypothesis, option=orjson.OPT_SORT_KEYS), self.llm.temperature)
+            formula = self._memo.get(key)
+            if formula is None:
+                try:
+                    formula = self._generate_with_llm(hypothesis)
+                except Exception as exc:
+                    print(f"LLM factor generation failed, falling back to heuristics: {exc}")
+                if formula:
+                    self._memo.put(key, formula)
+
+        return self._finalize_factor(formula, hypothesis)
+
+    async def construct_factors(self, hypotheses: list[dict], temperatures: list[float], llm: AsyncLLMClient) -> list[str]:
+        """
+        Constructs one formulaic alpha per hypothesis, with all LLM requests in flight at once.
+        Only the (hypothesis, temperature) pairs without a memoized formula are sent.
+
+        Args:
+            hypotheses: The structured market hypotheses.
+            temperatures: The sampling temperature used for each hypothesis.
+            llm: The asynchronous client used to issue the requests.
+
+        Returns:
+            A list of formulaic alphas or error messages, in the order of the hypotheses.
+        """
+        if not llm.is_available():
+            return [self.construct_factor(hypothesis) for hypothesis in hypotheses]
+
+        keys = [(orjson.dumps(h, option=orjson.OPT_SORT_KEYS), t) for h, t in zip(hypotheses, temperatures)]
+        prompts = {}
+        for key, hypothesis in zip(keys, hypotheses):
+            if key not in self._memo and key not in prompts:
+                prompts[key] = (*self._build_prompts(hypothesis), key[1])
+        results = await llm.chat_batch(list(prompts.values()))
 
+        for key, result in zip(prompts, results):
+            if isinstance(result, BaseException):
+                print(f"LLM factor generation failed, falling back to heuristics: {result}")
+                continue
+            formula = self._parse_expression(result)
+            if formula:
+                self._memo.put(key, formula)
+
+        return [self._finalize_factor(self._memo.get(key), h) for key, h in zip(keys, hypotheses)]
+
+    def _finalize_factor(self, formula: Optional[str], hypothesis: dict) -> str:
+        """
+        Falls back to a heuristic formula if none was generated, then applies the regularization checks.
+        """
+        # This is a simplified implementation. In a real-world scenario, this method would use an LLM to generate the formula.
+        # For this example, we will use a predefined formula based on the hypothesis.
         if not formula:
-            hypothesis_text = " ".join(str(value).lower() for value in hypothesis.values())
-
-            if "breakout" in hypothesis_text and "momentum" in hypothesis_text:
-                formula = "Rank(ts_delta(close, 20) - ts_delta(close, 5))"
-            elif "order flow" in hypothesis_text and "imbalance" in hypothesis_text:
-                formula = "Rank(ts_delta(close, 1) * volume)"
-            elif "mean reversion" in hypothesis_text or "revert" in hypothesis_text:
-                formula = "-Rank(ts_delta(close, 5))"
-            else:
-                formula = "Rank(ts_delta(close, 7) - ts_delta(close, 30))"
-
-        if not self._check_complexity(formula):
+            hypothesis_text = " ".join(str(value) for value in hypothesis.values())
+            keywords = {match.lastgroup for match in _KEYWORD_RE.finditer(hypothesis_text)}
+            formula = next(
+                (candidate for required, candidate in _HEURISTIC_FORMULAS if required <= keywords),
+                _DEFAULT_FORMULA,
+            )
+
+        # Parse once; both regularization checks share the tree
+        try:
+            tree = _parse_formula(formula)
+        except SyntaxError:
+            return "Error: Formula could not be parsed."
+
+        if not self._check_complexity(tree):
             return "Error: Formula is too complex."
 
-        if not self._check_originality(formula):
+        if not self._check_originality(tree):
             return "Error: Formula is not original enough."
 
         return formula
 
-    def _generate_with_llm(self, hypothesis: dict) -> str:
+    def _build_prompts(self, hypothesis: dict) -> tuple[str, str]:
         system_prompt = (
             "You are a quantitative researcher who writes concise alpha factors. "
             "Return a single Python expression using helper functions such as Rank, ts_delta, Correlation, "
             "SMA, EMA, and data series like close, open, high, low, volume."
         )
-        hypothesis_json = json.dumps(hypothesis, indent=2)
+        hypothesis_json = orjson.dumps(hypothesis, option=orjson.OPT_INDENT_2).decode()
         user_prompt = (
             "Hypothesis:\n"
             f"{hypothesis_json}\n\n"
             "Produce a single-line factor expression (no code fences, no explanation)."
         )
-        expression = self.llm.chat(system_prompt, user_prompt).strip()
-        return expression.splitlines()[0].strip()
+        return system_prompt, user_prompt
+
+    def _parse_expression(self, content: str) -> Optional[str]:
+        # Blank replies yield None, so the caller falls back to the heuristics
+        lines = content.strip().splitlines()
+        return lines[0].strip() if lines else None
+
+    def _generate_with_llm(self, hypothesis: dict) -> Optional[str]:
+        expression = self.llm.chat(*self._build_prompts(hypothesis))
+        return self._parse_expression(expression)
@@ -1,7 +1,13 @@
-import json
+import re
 from typing import Optional
 
-from utils.llm_client import LLMClient
+import orjson
+
+from utils.llm_client import AsyncLLMClient, LLMClient
+from utils.memo import BoundedMemo
+
+# Phrases that select a template hypothesis, all matched in a single pass over the idea
+_TEMPLATE_RE = re.compile(r'(?P<breakout_momentum>momentum after price breakouts)|(?P<order_flow>Order Flow Imbalance)')
 
 class IdeaAgent:
     """
@@ -10,10 +16,14 @@ class IdeaAgent:
 
     def __init__(self, llm_client: Optional[LLMClient] = None):
         self.llm = llm_client
+        # Successful LLM hypotheses of both the single and the batched path, keyed on (normalized idea, temperature),
+        # so repeated prompts skip the LLM round-trip
+        self._memo = BoundedMemo(maxsize=1024)
 
     def propose_hypothesis(self, user_input: str) -> str:
         """
         Takes a user's trading idea and refines it into a structured market hypothesis.
+        LLM results are memoized on the whitespace-normalized idea and the client's temperature; failed requests are not, so they are retried.
 
         Args:
             user_input: A string containing the user's trading idea.
@@ -21,36 +31,84 @@ class IdeaAgent:
         Returns:
             A JSON string representing the structured market hypothesis.
         """
+        user_input = " ".join(user_input.split())
+        if not (self.llm and self.llm.is_available()):
+            return self._template_hypothesis(user_input)
 
-        if self.llm and self.llm.is_available():
-            system_prompt = (
-                "You are a quantitative research assistant. "
-                "Convert the user's trading idea into a structured JSON hypothesis with the keys: "
-                "Observation, Knowledge, Argument, Specification. "
-                "Each value should be a short paragraph."
-            )
-            user_prompt = (
-                "Trading idea:\n"
-                f"{user_input}\n\n"
-                "Return only valid JSON."
-            )
+        key = (user_input, self.llm.temperature)
+        hypothesis = self._memo.get(key)
+        if hypothesis is None:
             try:
-                hypothesis_dict = self.llm.chat_json(system_prompt, user_prompt)
-                return json.dumps(hypothesis_dict, indent=4)
+                hypothesis = self._propose_hypothesis(user_input)
             except Exception as exc:
                 print(f"LLM hypothesis generation failed, falling back to template: {exc}")
+                return self._template_hypothesis(user_input)
+            self._memo.put(key, hypothesis)
+        return hypothesis
+
+    async def propose_hypotheses(self, user_input: str, temperatures: list[float], llm: AsyncLLMClient) -> list[str]:
+        """
+        Refines a trading idea into one hypothesis per sampling temperature, with all LLM requests in flight at once.
+        Only the (idea, temperature) pairs without a memoized reply are sent.
+
+        Args:
+            user_input: A string containing the user's trading idea.
+            temperatures: The sampling temperature of each requested hypothesis.
+            llm: The asynchronous client used to issue the requests.
+
+        Returns:
+            A list of JSON strings, one per temperature, representing the structured market hypotheses.
+        """
+        user_input = " ".join(user_input.split())
+        if not llm.is_available():
+            return [self.propose_hypothesis(user_input)] * len(temperatures)
+
+        system_prompt, user_prompt = self._build_prompts(user_input)
+        keys = [(user_input, t) for t in temperatures]
+        misses = [key for key in dict.fromkeys(keys) if key not in self._memo]
+        results = await llm.chat_json_batch([(system_prompt, user_prompt, t) for _, t in misses])
+
+        for key, result in zip(misses, results):
+            if isinstance(result, BaseException):
+                print(f"LLM hypothesis generation failed, falling back to template: {result}")
+                continue
+            self._memo.put(key, orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
+
+        return [self._memo.get(key) or self._template_hypothesis(user_input) for key in keys]
+
+    def _build_prompts(self, user_input: str) -> tuple[str, str]:
+        system_prompt = (
+            "You are a quantitative research assistant. "
+            "Convert the user's trading idea into a structured JSON hypothesis with the keys: "
+            "Observation, Knowledge, Argument, Specification. "
+            "Each value should be a short paragraph."
+        )
+        user_prompt = (
+            "Trading idea:\n"
+            f"{user_input}\n\n"
+            "Return only valid JSON."
+        )
+        return system_prompt, user_prompt
+
+    def _propose_hypothesis(self, user_input: str) -> str:
+        # Raises on failure, so the template fallback is never memoized
+        system_prompt, user_prompt = self._build_prompts(user_input)
+        hypothesis_dict = self.llm.chat_json(system_prompt, user_prompt)
+        return orjson.dumps(hypothesis_dict, option=orjson.OPT_INDENT_2).decode()
 
+    def _template_hypothesis(self, user_input: str) -> str:
         # This is a simplified implementation. In a real-world scenario, this method would use an LLM to generate the hypothesis.
         # For this example, we will use a predefined structure based on the user's input.
 
-        if "momentum after price breakouts" in user_input:
+        matched = {match.lastgroup for match in _TEMPLATE_RE.finditer(user_input)}
+        if "breakout_momentum" in matched:
             hypothesis = {
                 "Observation": "Prices of financial assets often exhibit momentum, continuing to move in the same direction after a significant price change, known as a breakout.",
                 "Knowledge": "This phenomenon is often attributed to behavioral biases such as herding and confirmation bias, as well as the gradual dissemination of information in the market.",
                 "Argument": "By identifying price breakouts, we can systematically enter positions in the direction of the breakout to capture the subsequent momentum.",
                 "Specification": "A trading strategy will be developed to identify breakouts (e.g., price exceeding a 20-day high) and enter a long position, with a trailing stop-loss to manage risk."
             }
-        elif "Order Flow Imbalance" in user_input:
+        elif "order_flow" in matched:
             hypothesis = {
                 "Observation": "Market microstructure data reveals that imbalances between buying and selling pressure at the micro-level often precede short-term price movements.",
                 "Knowledge": "These imbalances, known as order flow imbalances, reflect the aggressive side of the market and can be a strong predictor of immediate price direction.",
@@ -66,4 +124,4 @@ class IdeaAgent:
                 "Specification": "The strategy will be backtested using historical data to evaluate its performance."
             }
 
-        return json.dumps(hypothesis, indent=4)
+        return orjson.dumps(hypothesis, option=orjson.OPT_INDENT_2).decode()
@@ -1,25 +1,35 @@
 from ib_insync import IB, Stock, util  # type: ignore[import-not-found]
-import queue
-from backtester.events import MarketEvent
+import asyncio
+import datetime
+import hashlib
+import pathlib
+from backtester.events import MARKET_EVENT, DequeQueue
+import numpy as np
 import pandas as pd
 
+# Column layout of the per-symbol bar arrays
+BAR_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+COL_IDX = {column: i for i, column in enumerate(BAR_COLUMNS)}
+
 class IBKRDataHandler:
     """
     IBKRDataHandler is designed to connect to Interactive Brokers Trader Workstation (TWS) or IB Gateway,
     fetch historical data, and provide market data for backtesting.
     """
 
-    def __init__(self, events: queue.Queue, host='127.0.0.1', port=7497, clientId=1):
+    def __init__(self, events: DequeQueue | None, host='127.0.0.1', port=7497, clientId=1, cache_dir='.cache/bars'):
         """
         Initialises the data handler by connecting to IBKR.
 
         Args:
-            events: The event queue for the backtesting system.
+            events: The event queue for the backtesting system, or None if nothing consumes MarketEvents.
             host: The host address of TWS/IB Gateway.
             port: The port for TWS/IB Gateway.
             clientId: The client ID for the connection.
+            cache_dir: Directory of the on-disk Parquet cache of fetched bars, or None to always fetch from IBKR.
         """
         self.events = events
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
         self.ib = IB()
         try:
             self.ib.connect(host, port, clientId)
@@ -28,13 +38,20 @@ class IBKRDataHandler:
             print("Please ensure TWS or IB Gateway is running and the connection parameters are correct.")
             raise
 
+        self.symbol_list: list[str] = []
         self.symbol_data: dict[str, pd.DataFrame] = {}
-        self.latest_symbol_data: dict[str, list] = {}
+        self._bars: dict[str, np.ndarray] = {}
+        self._dates: dict[str, np.ndarray] = {}
+        self._cursor: dict[str, int] = {}
+        self._panels: dict[str, np.ndarray] = {}
+        self._panel_dates: pd.Index | None = None
+        self._panel_rows: dict[str, np.ndarray] = {}
+        self._returns_panel: np.ndarray | None = None
         self.continue_backtest = True
 
     def fetch_historical_data(self, symbol: str, durationStr='1 Y', barSizeSetting='1 day', whatToShow='TRADES'):
         """
-        Fetches historical bar data for a specified contract.
+        Fetches historical bar data for a specified contract and adds it to the symbol_list.
 
         Args:
             symbol: The stock symbol (e.g., 'AAPL').
@@ -42,46 +59,221 @@ class IBKRDataHandler:
             barSizeSetting: The bar size (e.g., '1 min', '1 hour', '1 day').
             whatToShow: The type of data to fetch (e.g., 'TRADES', 'MIDPOINT', 'BID', 'ASK').
         """
-        contract = Stock(symbol, 'SMART', 'USD')
-        bars = self.ib.reqHistoricalData(
-            contract,
-            endDateTime='',
-            durationStr=durationStr,
-            barSizeSetting=barSizeSetting,
-            whatToShow=whatToShow,
-            useRTH=True
-        )
-        self.symbol_data[symbol] = util.df(bars)
-        self.latest_symbol_data[symbol] = []
-
-    def stream_next_bar(self):
-        """
-        Iterates through the fetched bars, converts each bar into a MarketEvent,
-        and places it onto the event queue.
-        This is a generator that yields each bar.
-        """
-        for symbol, data in self.symbol_data.items():
-            for bar in data.itertuples():
-                self.latest_symbol_data[symbol].append(bar)
-                self.events.put(MarketEvent())
-                yield
+        cache_path = self._cache_path(symbol, durationStr, barSizeSetting, whatToShow)
+        cached = self._load_cached(cache_path)
+        if cached is not None:
+            stored = self._store_bars(symbol, cached)
+        else:
+            contract = Stock(symbol, 'SMART', 'USD')
+            bars = self.ib.reqHistoricalData(
+                contract,
+                endDateTime='',
+                durationStr=durationStr,
+                barSizeSetting=barSizeSetting,
+                whatToShow=whatToShow,
+                useRTH=True
+            )
+            df = util.df(bars)
+            stored = self._store_bars(symbol, df)
+            if stored:
+                self._save_cached(cache_path, df)
+
+        # _store_bars already invalidated the panels, so they are rebuilt with the new column
+        if stored and symbol not in self.symbol_list:
+            self.symbol_list.append(symbol)
+
+    def fetch_historical_data_many(self, symbols: list[str], durationStr='1 Y', barSizeSetting='1 day', whatToShow='TRADES'):
+        """
+        Fetches historical bar data for several contracts concurrently and makes them the symbol_list.
+        Blocking wrapper around fetch_historical_data_many_async.
+        """
+        self.ib.run(self.fetch_historical_data_many_async(symbols, durationStr, barSizeSetting, whatToShow))
+
+    async def fetch_historical_data_many_async(self, symbols: list[str], durationStr='1 Y', barSizeSetting='1 day', whatToShow='TRADES'):
+        """
+        Fetches historical bar data for several contracts with all requests in flight at once,
+        so the latency is that of the slowest request rather than the sum of all of them.
+        Symbols for which IBKR returns no bars are reported and left out of the symbol_list.
+
+        Args:
+            symbols: The stock symbols (e.g., ['AAPL', 'MSFT']).
+            durationStr: The duration of the data to fetch (e.g., '1 Y', '1 M', '1 D').
+            barSizeSetting: The bar size (e.g., '1 min', '1 hour', '1 day').
+            whatToShow: The type of data to fetch (e.g., 'TRADES', 'MIDPOINT', 'BID', 'ASK').
+        """
+        cache_paths = {symbol: self._cache_path(symbol, durationStr, barSizeSetting, whatToShow) for symbol in symbols}
+        missing = []
+        stored = set()
+        for symbol in symbols:
+            cached = self._load_cached(cache_paths[symbol])
+            if cached is None:
+                missing.append(symbol)
+            elif self._store_bars(symbol, cached):
+                stored.add(symbol)
+
+        all_bars = await asyncio.gather(*[
+            self.ib.reqHistoricalDataAsync(
+                Stock(symbol, 'SMART', 'USD'),
+                endDateTime='',
+                durationStr=durationStr,
+                barSizeSetting=barSizeSetting,
+                whatToShow=whatToShow,
+                useRTH=True
+            )
+            for symbol in missing
+        ])
+        for symbol, bars in zip(missing, all_bars):
+            df = util.df(bars)
+            if self._store_bars(symbol, df):
+                self._save_cached(cache_paths[symbol], df)
+                stored.add(symbol)
+        self.symbol_list = [symbol for symbol in symbols if symbol in stored]
+        self._invalidate_panels()
+
+    def _cache_path(self, symbol: str, durationStr: str, barSizeSetting: str, whatToShow: str) -> pathlib.Path | None:
+        """
+        Returns the cache file of a request. The key includes today's date, so cached bars are refetched daily.
+        """
+        if self.cache_dir is None:
+            return None
+        key = hashlib.sha1(
+            f"{symbol}|{durationStr}|{barSizeSetting}|{whatToShow}|{datetime.date.today()}".encode()
+        ).hexdigest()
+        return self.cache_dir / f"{key}.parquet"
+
+    def _load_cached(self, path: pathlib.Path | None) -> pd.DataFrame | None:
+        if path is None or not path.exists():
+            return None
+        return pd.read_parquet(path)
+
+    def _save_cached(self, path: pathlib.Path | None, df: pd.DataFrame | None):
+        if path is None or df is None or df.empty:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so an interrupted run never leaves a truncated cache entry
+        tmp_path = path.with_suffix('.tmp')
+        df.to_parquet(tmp_path, compression='zstd')
+        tmp_path.replace(path)
+
+    def _store_bars(self, symbol: str, df: pd.DataFrame | None) -> bool:
+        """
+        Stores the fetched bars of a symbol and invalidates the cached panels.
+
+        Returns:
+            False if there were no bars to store, True otherwise.
+        """
+        if df is None or df.empty:
+            print(f"No bars returned for {symbol}, skipping it.")
+            return False
+
+        self.symbol_data[symbol] = df
+        self._bars[symbol] = df[list(BAR_COLUMNS)].to_numpy(dtype=np.float64)
+        self._dates[symbol] = df['date'].to_numpy()
+        self._cursor[symbol] = -1
+        self._invalidate_panels()
+        return True
+
+    def _invalidate_panels(self):
+        """
+        Drops the cached panels, e.g. after new bars were stored or the symbol_list changed.
+        """
+        self._panels.clear()
+        self._panel_dates = None
+        self._returns_panel = None
+
+    def _panel_layout(self) -> tuple[pd.Index, dict[str, np.ndarray]]:
+        """
+        Returns the sorted union of the bar dates of all symbols in symbol_list, and the row of each
+        symbol's bars within it. Symbols with shorter histories or missing bars leave NaN gaps in the panels,
+        so every panel row holds the same date across the cross-section.
+        """
+        if self._panel_dates is None:
+            dates = [self._dates[symbol] for symbol in self.symbol_list]
+            self._panel_dates = pd.Index(np.concatenate(dates) if dates else []).unique().sort_values()
+            self._panel_rows = {
+                symbol: self._panel_dates.get_indexer(self._dates[symbol]) for symbol in self.symbol_list
+            }
+        return self._panel_dates, self._panel_rows
+
+    def get_panel_dates(self) -> pd.Index:
+        """
+        Returns the dates of the rows of the panels.
+        """
+        return self._panel_layout()[0]
+
+    def get_panel(self, field: str) -> np.ndarray:
+        """
+        Returns a contiguous (T, N) float32 panel of a bar field (e.g. 'close'), with one column per symbol in symbol_list.
+        Rows are aligned on the union of the symbols' dates; bars a symbol lacks are NaN.
+        Single precision halves the memory traffic of the factor kernels that scan it.
+        The panel is built once and reused until new data is fetched.
+        """
+        panel = self._panels.get(field)
+        if panel is None:
+            dates, rows = self._panel_layout()
+            panel = np.full((len(dates), len(self.symbol_list)), np.nan, dtype=np.float32)
+            for j, symbol in enumerate(self.symbol_list):
+                panel[rows[symbol], j] = self._bars[symbol][:, COL_IDX[field]]
+            self._panels[field] = panel
+        return panel
+
+    def get_returns_panel(self) -> np.ndarray:
+        """
+        Returns the (T-1, N) panel of one-bar log returns of the close prices.
+        Cached alongside the bar panels so repeated factor evaluations share it.
+        """
+        if self._returns_panel is None:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._returns_panel = np.diff(np.log(self.get_panel('close')), axis=0)
+        return self._returns_panel
+
+    def advance(self) -> bool:
+        """
+        Moves every symbol forward by one bar and, if an event queue is attached, places MARKET_EVENT on it.
+        Bars are never copied; the latest bar is read from the stored arrays through a per-symbol cursor.
+
+        Returns:
+            False once all symbols have run out of bars, True otherwise.
+        """
+        advanced = False
+        for symbol, bars in self._bars.items():
+            if self._cursor[symbol] + 1 < len(bars):
+                self._cursor[symbol] += 1
+                advanced = True
+
+        if not advanced:
+            self.continue_backtest = False
+            return False
+
+        if self.events is not None:
+            self.events.put(MARKET_EVENT)
+        return True
 
     def get_latest_bar_datetime(self, symbol: str):
         """
         Returns the datetime of the latest bar.
         """
-        if self.latest_symbol_data.get(symbol):
-            return self.latest_symbol_data[symbol][-1].date
+        cursor = self._cursor.get(symbol, -1)
+        if cursor >= 0:
+            return self._dates[symbol][cursor]
         return None
 
     def get_latest_bar_value(self, symbol: str, val_type: str):
         """
         Returns a specific value (e.g., 'close') of the latest bar.
         """
-        if self.latest_symbol_data.get(symbol):
-            return getattr(self.latest_symbol_data[symbol][-1], val_type.lower())
+        cursor = self._cursor.get(symbol, -1)
+        if cursor >= 0:
+            return self._bars[symbol][cursor, COL_IDX[val_type.lower()]]
         return None
 
+    def get_latest_bars_values(self, symbol: str, val_type: str, N: int = 1) -> np.ndarray:
+        """
+        Returns a view of the last N values (e.g., 'close') up to and including the latest bar.
+        """
+        cursor = self._cursor.get(symbol, -1)
+        return self._bars[symbol][max(cursor + 1 - N, 0):cursor + 1, COL_IDX[val_type.lower()]]
+
     def disconnect(self):
         """
         Disconnects from IBKR.
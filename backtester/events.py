@@ -1,21 +1,57 @@
+import collections
+import queue
+
+class DequeQueue(collections.deque):
+    """
+    Event queue for the single-threaded backtest loop.
+    Exposes the put/get/empty subset of the queue.Queue API on a collections.deque, without queue.Queue's locking.
+    """
+    __slots__ = ()
+
+    put = collections.deque.append
+
+    def get(self, block=True, timeout=None):
+        """
+        Removes and returns the oldest event, raising queue.Empty if there is none.
+        The block and timeout arguments are accepted for compatibility and ignored.
+        """
+        try:
+            return self.popleft()
+        except IndexError:
+            raise queue.Empty from None
+
+    def empty(self):
+        return not self
+
+    def qsize(self):
+        return len(self)
+
 class Event:
     """
     Base class for all events.
+    Events declare __slots__ so instances carry no per-object __dict__.
     """
-    pass
+    __slots__ = ()
 
 class MarketEvent(Event):
     """
     Handles the event of receiving new market data.
+    It carries no data, so producers can reuse MARKET_EVENT instead of allocating one per bar.
     """
+    __slots__ = ('type',)
+
     def __init__(self):
         self.type = 'MARKET'
 
+MARKET_EVENT = MarketEvent()
+
 class SignalEvent(Event):
     """
     Handles the event of sending a signal from a Strategy object.
     This is received by a Portfolio object and acted upon.
     """
+    __slots__ = ('type', 'symbol', 'datetime', 'signal_type')
+
     def __init__(self, symbol, datetime, signal_type):
         self.type = 'SIGNAL'
         self.symbol = symbol
@@ -28,6 +64,8 @@ class OrderEvent(Event):
     The order contains a symbol (e.g. GOOG), a type (market or limit),
     quantity and a direction.
     """
+    __slots__ = ('type', 'symbol', 'order_type', 'quantity', 'direction')
+
     def __init__(self, symbol, order_type, quantity, direction):
         self.type = 'ORDER'
         self.symbol = symbol
@@ -44,6 +82,8 @@ class FillEvent(Event):
     Stores the quantity of an instrument actually filled and at what price.
     In addition, stores the commission of the trade from the brokerage.
     """
+    __slots__ = ('type', 'timeindex', 'symbol', 'exchange', 'quantity', 'direction', 'fill_cost', 'commission')
+
     def __init__(self, timeindex, symbol, exchange, quantity, direction, fill_cost, commission=None):
         self.type = 'FILL'
         self.timeindex = timeindex
@@ -65,9 +105,5 @@ class FillEvent(Event):
         This does not include exchange or ECN fees.
         Based on https://www.interactivebrokers.com/en/index.php?f=1590&p=stocks2
         """
-        full_cost = 1.3
-        if self.quantity <= 500:
-            full_cost = max(1.3, 0.013 * self.quantity)
-        else: # Greater than 500
-            full_cost = max(1.3, 0.008 * self.quantity)
-        return full_cost
\ No newline at end of file
+        q = self.quantity
+        return max(1.3, 0.013 * q if q <= 500 else 0.008 * q)
\ No newline at end of file
@@ -1,4 +1,3 @@
-import datetime
 from backtester.events import FillEvent, OrderEvent
 
 class SimulatedExecutionHandler:
@@ -7,11 +6,15 @@ class SimulatedExecutionHandler:
     considering slippage or latency. This allows a straightforward first-pass backtest.
     """
 
-    def __init__(self, events):
+    def __init__(self, events, data_handler):
         """
         Initialises the handler, setting the event queue to an empty list.
+        Parameters:
+        events - The Event Queue object.
+        data_handler - The DataHandler object whose latest bar timestamps the fills.
         """
         self.events = events
+        self.data_handler = data_handler
 
     def execute_order(self, event):
         """
@@ -21,6 +24,6 @@ class SimulatedExecutionHandler:
         """
         if event.type == 'ORDER':
             fill_event = FillEvent(
-                datetime.datetime.utcnow(), event.symbol, 'ARCA', event.quantity, event.direction, None
+                self.data_handler.get_latest_bar_datetime(event.symbol), event.symbol, 'ARCA', event.quantity, event.direction, None
             )
             self.events.put(fill_event)
\ No newline at end of file
@@ -1,12 +1,143 @@
-import queue
-import json
-from ib_insync import Stock  # type: ignore[import-not-found]
+import asyncio
+import collections
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 from agents.idea_agent import IdeaAgent
 from agents.factor_agent import FactorAgent
 from agents.eval_agent import EvalAgent
-from backtester.data_handler import IBKRDataHandler
-from utils.llm_client import LLMClient
+from backtester.data_handler import BAR_COLUMNS, IBKRDataHandler
+from backtester.events import DequeQueue
+from utils.llm_client import AsyncLLMClient, LLMClient
+
+NUM_ITERATIONS = 5
+# One candidate per sampling temperature is proposed and evaluated concurrently in every iteration;
+# the best one's feedback refines the idea
+TEMPERATURES = [0.2, 0.5, 0.8]
+# The factors are scored cross-sectionally, so the search runs on a universe of liquid US large caps
+UNIVERSE = ['AAPL', 'MSFT', 'AMZN', 'GOOGL', 'META', 'NVDA', 'JPM', 'XOM', 'JNJ', 'PG', 'KO', 'WMT']
+# Only the most recent feedbacks refine the idea, so the prompt does not grow with every iteration
+FEEDBACK_WINDOW = 3
+
+# Per-process state of the worker pool, populated by _init_worker
+_worker_panels: dict[str, np.ndarray] = {}
+_worker_segments: list[SharedMemory] = []
+_worker_eval_agent = EvalAgent()
+
+def _share_panels(panels: dict[str, np.ndarray]) -> tuple[list[SharedMemory], dict[str, tuple[str, tuple, str]]]:
+    """
+    Copies each panel into a shared memory segment once, so worker processes can map it without pickling.
+    Returns the segments (owned by the caller) and the specs the workers need to attach to them.
+    """
+    segments = []
+    specs = {}
+    for name, panel in panels.items():
+        segment = SharedMemory(create=True, size=max(panel.nbytes, 1))
+        np.ndarray(panel.shape, dtype=panel.dtype, buffer=segment.buf)[...] = panel
+        segments.append(segment)
+        specs[name] = (segment.name, panel.shape, panel.dtype.str)
+    return segments, specs
+
+def _init_worker(specs: dict[str, tuple[str, tuple, str]]):
+    """
+    Attaches a worker process to the shared, read-only panels.
+    """
+    for name, (segment_name, shape, dtype) in specs.items():
+        segment = SharedMemory(name=segment_name)
+        panel = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+        panel.flags.writeable = False
+        _worker_segments.append(segment)
+        _worker_panels[name] = panel
+
+def evaluate_candidate(factor_code: str) -> tuple[list, str]:
+    """
+    Evaluates one candidate factor in a worker process against the shared panels.
+
+    Returns:
+        The performance metrics and the feedback.
+    """
+    eval_result = _worker_eval_agent.evaluate_panels(factor_code, _worker_panels.__getitem__, _worker_panels['returns'])
+    return eval_result['performance_metrics'], eval_result['feedback']
+
+def _sharpe_ratio(performance_metrics: list) -> float:
+    for metric in performance_metrics:
+        if metric[0] == "Sharpe Ratio":
+            return float(metric[1])
+    return 0.0
+
+async def _search(user_idea: str, executor: ProcessPoolExecutor, llm_client: LLMClient) -> tuple[str | None, float]:
+    """
+    Runs the iterative alpha search. LLM requests of all candidates are in flight concurrently,
+    and the resulting factors are evaluated in parallel by the worker processes.
+
+    Returns:
+        The best-performing factor and its Sharpe Ratio.
+    """
+    idea_agent = IdeaAgent(llm_client=llm_client)
+    factor_agent = FactorAgent(llm_client=llm_client)
+    loop = asyncio.get_running_loop()
+
+    best_factor = None
+    best_performance = {"Sharpe Ratio": -1000.0}
+    original_idea = user_idea
+    feedback_hist: collections.deque[str] = collections.deque(maxlen=FEEDBACK_WINDOW)
+
+    async with AsyncLLMClient(llm_client) as async_llm:
+        # 5. Start a loop for a fixed number of iterations
+        for i in range(NUM_ITERATIONS):
+            print(f"\n----- Iteration {i+1} -----")
+
+            # 6a. The IdeaAgent refines the idea into one hypothesis per candidate
+            print("IdeaAgent: Refining the idea...")
+            hypotheses = [orjson.loads(h) for h in await idea_agent.propose_hypotheses(user_idea, TEMPERATURES, async_llm)]
+
+            # 6b. The FactorAgent constructs a formulaic alpha for each hypothesis
+            print("FactorAgent: Constructing factors...")
+            factor_codes = await factor_agent.construct_factors(hypotheses, TEMPERATURES, async_llm)
+
+            # 6c. The EvalAgent backtests the valid alphas in parallel
+            print("EvalAgent: Evaluating the factors...")
+            candidates = []
+            for hypothesis, factor_code in zip(hypotheses, factor_codes):
+                if "Error" in factor_code:
+                    print(f"\nHypothesis: {hypothesis['Argument']}")
+                    print(f"FactorAgent Error: {factor_code}")
+                    continue
+                if any(code == factor_code for _, code, _ in candidates):
+                    continue
+                future = loop.run_in_executor(executor, evaluate_candidate, factor_code)
+                candidates.append((hypothesis, factor_code, future))
+
+            iteration_best = None
+            for hypothesis, factor_code, future in candidates:
+                performance_metrics, feedback = await future
+                print(f"\nHypothesis: {hypothesis['Argument']}")
+                print(f"Factor: {factor_code}")
+                print(f"Performance: {performance_metrics}")
+                print(f"Feedback: {feedback}")
+
+                # 6d. Print the best-performing factor so far
+                current_sharpe = _sharpe_ratio(performance_metrics)
+                if current_sharpe > best_performance["Sharpe Ratio"]:
+                    best_performance["Sharpe Ratio"] = current_sharpe
+                    best_factor = factor_code
+                    print(f"New best factor found: {best_factor} with Sharpe Ratio: {current_sharpe}")
+
+                if iteration_best is None or current_sharpe > iteration_best[0]:
+                    iteration_best = (current_sharpe, feedback)
+
+            # 6e. Use the feedback of the recent iterations' best candidates to refine the initial idea
+            if iteration_best is None:
+                feedback_hist.append("The previous formula was not good. Let's try a different approach.")
+            else:
+                feedback_hist.append(iteration_best[1])
+            # dict.fromkeys drops repeated feedback while keeping its order
+            user_idea = f"{original_idea} {' '.join(dict.fromkeys(feedback_hist))}"
+
+    return best_factor, best_performance["Sharpe Ratio"]
 
 def main():
     """
@@ -16,7 +147,7 @@ def main():
     llm_client = LLMClient()
 
     # 1. Initialize the event queue and the IBKRDataHandler
-    events = queue.Queue()
+    events = DequeQueue()
     # Make sure you have TWS or IB Gateway running
     try:
         data_handler = IBKRDataHandler(events, host='127.0.0.1', port=7497, clientId=1)
@@ -24,68 +155,32 @@ def main():
         print(f"Could not connect to IBKR: {e}")
         return
 
+    segments: list[SharedMemory] = []
     try:
-        # 2. Define an ib_insync contract object
-        contract = Stock('ES', 'SMART', 'USD')
-        data_handler.symbol_list = [contract.symbol]
-        data_handler.fetch_historical_data(contract.symbol)
+        # 2. Fetch the bars of every symbol in the universe
+        data_handler.fetch_historical_data_many(UNIVERSE)
 
-        # 3. Instantiate the agents
-        idea_agent = IdeaAgent(llm_client=llm_client)
-        factor_agent = FactorAgent(llm_client=llm_client)
-        eval_agent = EvalAgent()
+        # 3. Share the panels with the worker processes that evaluate the factors
+        panels = {field: data_handler.get_panel(field) for field in BAR_COLUMNS}
+        panels['returns'] = data_handler.get_returns_panel()
+        segments, specs = _share_panels(panels)
 
         # 4. Prompt the user for an initial trading idea
         user_idea = input("Please enter your trading idea: ")
 
-        best_factor = None
-        best_performance = {"Sharpe Ratio": -1000}
-
-        # 5. Start a loop for a fixed number of iterations
-        for i in range(5):
-            print(f"\n----- Iteration {i+1} -----")
-
-            # 6a. The IdeaAgent refines the idea into a hypothesis
-            print("IdeaAgent: Refining the idea...")
-            hypothesis_json = idea_agent.propose_hypothesis(user_idea)
-            hypothesis = json.loads(hypothesis_json)
-            print(f"Hypothesis: {hypothesis['Argument']}")
-
-            # 6b. The FactorAgent constructs a formulaic alpha
-            print("FactorAgent: Constructing a factor...")
-            factor_code = factor_agent.construct_factor(hypothesis)
-            if "Error" in factor_code:
-                print(f"FactorAgent Error: {factor_code}")
-                user_idea += " The previous formula was not good. Let's try a different approach."
-                continue
-            print(f"Factor: {factor_code}")
-
-            # 6c. The EvalAgent backtests the alpha
-            print("EvalAgent: Evaluating the factor...")
-            eval_result = eval_agent.evaluate_factor(factor_code, data_handler)
-            print(f"Performance: {eval_result['performance_metrics']}")
-            print(f"Feedback: {eval_result['feedback']}")
-
-            # 6d. Print the best-performing factor so far
-            current_sharpe = 0
-            for metric in eval_result['performance_metrics']:
-                if metric[0] == "Sharpe Ratio":
-                    current_sharpe = float(metric[1])
-            
-            if current_sharpe > best_performance["Sharpe Ratio"]:
-                best_performance["Sharpe Ratio"] = current_sharpe
-                best_factor = factor_code
-                print(f"New best factor found: {best_factor} with Sharpe Ratio: {current_sharpe}")
-
-            # 6e. Use the feedback to refine the initial idea
-            user_idea += f" {eval_result['feedback']}"
+        max_workers = min(len(TEMPERATURES), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(specs,)) as executor:
+            best_factor, best_sharpe = asyncio.run(_search(user_idea, executor, llm_client))
 
         # 7. Output the final, best-performing alpha factor
         print("\n----- Final Result -----")
         print(f"Best performing factor: {best_factor}")
-        print(f"Best performance (Sharpe Ratio): {best_performance['Sharpe Ratio']}")
+        print(f"Best performance (Sharpe Ratio): {best_sharpe}")
 
     finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
         # Ensure the connection to IBKR is properly disconnected
         print("\nDisconnecting from IBKR...")
         data_handler.disconnect()
@@ -1,8 +1,16 @@
+import asyncio
 import json
 import os
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+import httpx
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Used only for its incremental raw_decode, which orjson does not provide
+_JSON_DECODER = json.JSONDecoder()
 
 
 class LLMClient:
@@ -25,6 +33,35 @@ class LLMClient:
         self.model = model or self._resolve_model()
         self.timeout = timeout
         self.temperature = temperature
+        self._session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        """
+        Creates a pooled session so successive requests reuse the same keep-alive HTTPS connection.
+        Connection failures, rate limits and transient server errors are retried with backoff.
+        Read errors are not: the request may already have been processed (and billed), and a
+        slow completion would otherwise block for several timeouts.
+        """
+        session = requests.Session()
+        retries = Retry(
+            total=3,
+            read=0,
+            other=0,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
+        session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
+        session.headers.update(self._headers())
+        return session
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
 
     def _resolve_api_key(self) -> Optional[str]:
         if self.provider == "deepseek":
@@ -57,7 +94,18 @@ class LLMClient:
         if not self.is_available():
             raise RuntimeError("LLMClient is not configured with an API key or model.")
 
-        payload: Dict[str, Any] = {
+        url = f"{self.base_url}/chat/completions"
+        payload = self._build_payload(system_prompt, user_prompt, temperature)
+        response = self._session.post(url, data=orjson.dumps(payload), timeout=self.timeout)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as exc:
+            raise RuntimeError(f"LLM request failed with status {response.status_code}: {response.text}") from exc
+
+        return self._extract_content(orjson.loads(response.content))
+
+    def _build_payload(self, system_prompt: str, user_prompt: str, temperature: Optional[float]) -> Dict[str, Any]:
+        return {
             "model": self.model,
             "messages": [
                 {"role": "system", "content": system_prompt},
@@ -66,19 +114,7 @@ class LLMClient:
             "temperature": temperature if temperature is not None else self.temperature,
         }
 
-        url = f"{self.base_url}/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-
-        response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
-        try:
-            response.raise_for_status()
-        except requests.HTTPError as exc:
-            raise RuntimeError(f"LLM request failed with status {response.status_code}: {response.text}") from exc
-
-        data = response.json()
+    def _extract_content(self, data: Dict[str, Any]) -> str:
         choices = data.get("choices")
         if not choices:
             raise RuntimeError("LLM response did not include any choices.")
@@ -100,13 +136,77 @@ class LLMClient:
 
     def _coerce_json(self, content: str) -> Dict[str, Any]:
         try:
-            return json.loads(content)
-        except json.JSONDecodeError:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # Decode the first object in place, ignoring prose or code fences around it.
+            # raw_decode stops at the end of that object, so trailing text is never scanned.
             start = content.find("{")
-            end = content.rfind("}")
-            if start != -1 and end != -1:
+            if start != -1:
                 try:
-                    return json.loads(content[start : end + 1])
+                    return _JSON_DECODER.raw_decode(content, start)[0]
                 except json.JSONDecodeError as exc:
                     raise RuntimeError(f"Failed to parse JSON from LLM response: {content}") from exc
             raise RuntimeError(f"Failed to parse JSON from LLM response: {content}")
+
+
+class AsyncLLMClient:
+    """
+    Asynchronous counterpart of LLMClient for keeping many chat requests in flight at once.
+    Requests share a single HTTP/2 connection; provider, model and credentials come from an LLMClient.
+    """
+
+    def __init__(self, llm_client: Optional[LLMClient] = None, max_connections: int = 16) -> None:
+        self.llm = llm_client or LLMClient()
+        self._client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=max_connections),
+            timeout=self.llm.timeout,
+            headers=self.llm._headers(),
+        )
+
+    async def __aenter__(self) -> "AsyncLLMClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    def is_available(self) -> bool:
+        return self.llm.is_available()
+
+    async def chat(self, system_prompt: str, user_prompt: str, temperature: Optional[float] = None) -> str:
+        """
+        Sends a chat completion request and returns the raw message content.
+        """
+        if not self.is_available():
+            raise RuntimeError("LLMClient is not configured with an API key or model.")
+
+        url = f"{self.llm.base_url}/chat/completions"
+        payload = self.llm._build_payload(system_prompt, user_prompt, temperature)
+        response = await self._client.post(url, content=orjson.dumps(payload))
+        if response.is_error:
+            raise RuntimeError(f"LLM request failed with status {response.status_code}: {response.text}")
+
+        return self.llm._extract_content(orjson.loads(response.content))
+
+    async def chat_json(self, system_prompt: str, user_prompt: str, temperature: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Convenience helper that expects the LLM to return a JSON object.
+        """
+        content = await self.chat(system_prompt, user_prompt, temperature)
+        return self.llm._coerce_json(content)
+
+    async def chat_batch(self, prompts: List[Tuple[Any, ...]]) -> List[Union[str, BaseException]]:
+        """
+        Sends all (system_prompt, user_prompt[, temperature]) requests concurrently.
+        Results are returned in order; a failed request yields its exception instead of a message.
+        """
+        return await asyncio.gather(*(self.chat(*prompt) for prompt in prompts), return_exceptions=True)
+
+    async def chat_json_batch(self, prompts: List[Tuple[Any, ...]]) -> List[Union[Dict[str, Any], BaseException]]:
+        """
+        Like chat_batch, but coerces every response into a JSON object.
+        """
+        return await asyncio.gather(*(self.chat_json(*prompt) for prompt in prompts), return_exceptions=True)